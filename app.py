@@ -158,12 +158,17 @@ device_columns = [
     if c.endswith("_kW") and c not in ("base_load_kW", "total_load_kW")
 ]
 
-timeline_df = _build_timeline_from_schedule(sched_plot, device_columns)
+@st.cache_data(ttl=60 * 15)  # same lifetime as the cached predictions the schedule comes from
+def _timeline_figure_cached(sched_plot: pd.DataFrame, device_columns, day_start: pd.Timestamp):
+    """
+    Build the Gantt figure once per schedule. Streamlit reruns this whole script on every
+    interaction; reruns with the same schedule reuse the figure instead of rebuilding it.
+    Returns None when nothing was scheduled.
+    """
+    timeline_df = _build_timeline_from_schedule(sched_plot, device_columns)
+    if timeline_df.empty:
+        return None
 
-st.subheader(f"🗓️ Optimal Load Schedule — {day_start.strftime('%d %b %Y')} (30-min slots)")
-if timeline_df.empty:
-    st.info("No controllable loads were scheduled for tomorrow.")
-else:
     # Use the *local naive* columns so Plotly doesn't auto-convert timezones
     fig_timeline = px.timeline(
         timeline_df,
@@ -199,6 +204,14 @@ else:
         xaxis_title="Time of Day (Africa/Nairobi)",
         yaxis_title=""
     )
+    return fig_timeline
+
+fig_timeline = _timeline_figure_cached(sched_plot, device_columns, day_start)
+
+st.subheader(f"🗓️ Optimal Load Schedule — {day_start.strftime('%d %b %Y')} (30-min slots)")
+if fig_timeline is None:
+    st.info("No controllable loads were scheduled for tomorrow.")
+else:
     st.plotly_chart(fig_timeline, use_container_width=True)
 
 # ------------------ STEP 4: Export scheduled loads ------------------
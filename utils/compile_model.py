@@ -0,0 +1,22 @@
+# utils/compile_model.py
+
+# Offline step: compiles the trained XGBoost ensemble into a native shared library.
+# prediction_pipeline picks the library up automatically when it exists. Re-run after retraining.
+
+import joblib
+import tl2cgen
+import treelite
+
+MODEL_PATH = "models/xgb_model.pkl"
+MODEL_LIB_PATH = "models/xgb_model.so"
+
+def compile_model(model_path=MODEL_PATH, lib_path=MODEL_LIB_PATH):
+    booster = joblib.load(model_path).get_booster()
+    model = treelite.frontend.from_xgboost(booster)
+    tl2cgen.export_lib(model, toolchain="gcc", libpath=lib_path, params={"parallel_comp": 4})
+    print(f"Compiled model saved to: {lib_path}")
+    return lib_path
+
+# Testing the block
+if __name__ == "__main__":
+    compile_model()
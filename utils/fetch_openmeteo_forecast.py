@@ -26,7 +26,7 @@ def fetch_forecast(lat=-1.2921, lon=36.8219, save_path="data/tomorrow_irradiance
         raise Exception("Hourly forecast missing from response.")
 
     df = pd.DataFrame(data["hourly"])
-    df["time"] = pd.to_datetime(df["time"])
+    df["time"] = pd.to_datetime(df["time"], format="%Y-%m-%dT%H:%M", cache=True)  # Open-Meteo's fixed ISO format
     df = df.rename(columns={
         "shortwave_radiation": "GHI",
         "direct_normal_irradiance": "DNI",
@@ -1,81 +1,295 @@
 # utils/prediction_pipeline.py
 
+import asyncio
+import os
+import tempfile
+import time
+from functools import lru_cache
+
+import numpy as np
 import pandas as pd
 import requests
 import joblib
 from datetime import datetime, timedelta
 
+try:
+    import bottleneck as bn  # Optional. Single C loop for the GTI moving average.
+except ImportError:
+    bn = None
+
+try:
+    import httpx  # Optional. Only needed to fetch several locations concurrently.
+except ImportError:
+    httpx = None
+
+try:
+    import orjson as jsonlib  # Optional. Faster drop-in for json.loads on the hourly arrays.
+except ImportError:
+    import json as jsonlib
+
+try:
+    import tl2cgen  # Optional. Only needed to run the compiled model from utils/compile_model.py
+except ImportError:
+    tl2cgen = None
+
 NBO_TZ = "Africa/Nairobi"
+MODEL_LIB_PATH = "models/xgb_model.so"
 
-def fetch_openmeteo_forecast(lat, lon):
-    """
-    Fetch next-day hourly forecast from Open-Meteo, already in Africa/Nairobi.
-    We explicitly LOCALIZE to Africa/Nairobi (do NOT convert from UTC).
-    """
-    tomorrow = (datetime.now() + timedelta(days=1)).strftime("%Y-%m-%d")
-    url = (
+# Raw Open-Meteo responses are kept on disk per (lat, lon, tomorrow). Within the TTL no request is made;
+# after it, the server is asked with If-Modified-Since before a full download.
+FORECAST_CACHE_DIR = os.path.join(tempfile.gettempdir(), "openmeteo")
+FORECAST_CACHE_TTL = 60 * 60  # seconds
+
+# Model inputs, in the order the scaler and model were trained on.
+FEATURE_COLUMNS = ["Global Tilted Irradiation", "air_temp", "hour", "dayofyear"]
+
+def _tomorrow():
+    return (datetime.now() + timedelta(days=1)).strftime("%Y-%m-%d")
+
+
+def _forecast_url(lat, lon, tomorrow):
+    return (
         f"https://api.open-meteo.com/v1/forecast?"
         f"latitude={lat}&longitude={lon}"
         f"&hourly=global_tilted_irradiance,temperature_2m"
         f"&start_date={tomorrow}&end_date={tomorrow}"
         f"&timezone=Africa%2FNairobi"
     )
-    r = requests.get(url, timeout=30)
-    r.raise_for_status()
-    data = r.json()
 
-    ts = pd.to_datetime(data["hourly"]["time"])      # tz-naive timestamps
+
+def _forecast_cache_path(lat, lon, tomorrow):
+    return os.path.join(FORECAST_CACHE_DIR, f"{round(lat, 3)}_{round(lon, 3)}_{tomorrow}.json")
+
+
+def _read_cached_forecast(path):
+    """
+    Cached response body (None if there is none), whether it is still within the TTL,
+    and the request headers to revalidate it with once it is not.
+    """
+    try:
+        with open(path, "rb") as f:
+            body = f.read()
+        fresh = time.time() - os.path.getmtime(path) < FORECAST_CACHE_TTL
+    except OSError:
+        return None, False, {}
+
+    headers = {}
+    try:
+        with open(path + ".last-modified") as f:
+            headers["If-Modified-Since"] = f.read().strip()
+    except OSError:
+        pass
+    return body, fresh, headers
+
+
+def _store_forecast_response(path, cached, status_code, content, last_modified):
+    """
+    Response body to use after a (possibly conditional) request, updating the cache on the way.
+    A 304 reuses the cached body and restarts its TTL.
+    """
+    try:
+        if status_code == 304 and cached is not None:
+            os.utime(path)
+            return cached
+        os.makedirs(FORECAST_CACHE_DIR, exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(content)
+        os.replace(tmp, path)  # Atomic, so a concurrent reader never sees half a file.
+        if last_modified:
+            with open(path + ".last-modified", "w") as f:
+                f.write(last_modified)
+    except OSError:
+        pass  # The cache is only an optimization. Never fail a forecast over it.
+    return content
+
+
+def _forecast_frame(data):
+    """Build the forecast DataFrame from a parsed Open-Meteo response."""
+    hourly = data["hourly"]
+    # tz-naive timestamps. Open-Meteo always sends e.g. 2025-08-04T13:00, and an explicit format skips inference.
+    ts = pd.to_datetime(hourly["time"], format="%Y-%m-%dT%H:%M", cache=True)
     ts = ts.tz_localize(NBO_TZ)                      # localizing to Nairobi time. Key step. Do NOT convert from UTC.
 
+    # Typed float arrays up front (missing values become NaN), so pandas has nothing left to infer.
     df = pd.DataFrame({
         "timestamp": ts,
-        "Global Tilted Irradiation": data["hourly"]["global_tilted_irradiance"],
-        "air_temp": data["hourly"]["temperature_2m"],
+        "Global Tilted Irradiation": np.asarray(hourly["global_tilted_irradiance"], dtype=np.float64),
+        "air_temp": np.asarray(hourly["temperature_2m"], dtype=np.float64),
     })
     return df
 
 
+def fetch_openmeteo_forecast(lat, lon):
+    """
+    Fetch next-day hourly forecast from Open-Meteo, already in Africa/Nairobi.
+    We explicitly LOCALIZE to Africa/Nairobi (do NOT convert from UTC).
+    """
+    tomorrow = _tomorrow()
+    path = _forecast_cache_path(lat, lon, tomorrow)
+    cached, fresh, headers = _read_cached_forecast(path)
+    if fresh:
+        return _forecast_frame(jsonlib.loads(cached))
+
+    r = requests.get(_forecast_url(lat, lon, tomorrow), headers=headers, timeout=30)
+    if r.status_code != 304 or cached is None:
+        r.raise_for_status()
+    body = _store_forecast_response(path, cached, r.status_code, r.content, r.headers.get("Last-Modified"))
+    return _forecast_frame(jsonlib.loads(body))
+
+
+async def fetch_openmeteo_forecast_async(client, lat, lon):
+    """
+    Same as fetch_openmeteo_forecast, over a shared httpx.AsyncClient.
+    """
+    tomorrow = _tomorrow()
+    path = _forecast_cache_path(lat, lon, tomorrow)
+    cached, fresh, headers = _read_cached_forecast(path)
+    if fresh:
+        return _forecast_frame(jsonlib.loads(cached))
+
+    r = await client.get(_forecast_url(lat, lon, tomorrow), headers=headers)
+    if r.status_code != 304 or cached is None:
+        r.raise_for_status()
+    body = _store_forecast_response(path, cached, r.status_code, r.content, r.headers.get("Last-Modified"))
+    return _forecast_frame(jsonlib.loads(body))
+
+
+async def _gather_forecasts(coords):
+    # One client per batch: an AsyncClient's connection pool is tied to the event loop that opened it.
+    async with httpx.AsyncClient(timeout=30, headers={"Accept-Encoding": "gzip"}) as client:
+        return await asyncio.gather(*[fetch_openmeteo_forecast_async(client, lat, lon) for lat, lon in coords])
+
+
+def fetch_openmeteo_forecasts(coords):
+    """
+    Fetch forecasts for a list of (lat, lon) pairs concurrently, one DataFrame per location.
+    Falls back to one request at a time when httpx is not installed.
+    """
+    if httpx is None or len(coords) < 2:
+        return [fetch_openmeteo_forecast(lat, lon) for lat, lon in coords]
+    return list(asyncio.run(_gather_forecasts(coords)))
+
+
+def _centered_mean(values: np.ndarray, window: int = 3) -> np.ndarray:
+    """
+    Centered moving average that skips NaNs, same as .rolling(window, center=True, min_periods=1).mean().
+    Uses bottleneck when installed, else two small convolutions; pandas rolling is mostly
+    per-call overhead on 24 rows.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) == 0:
+        return values.copy()
+    half = (window - 1) // 2
+
+    if bn is not None and len(values) + half >= window:
+        # Trailing mean shifted back by `half` slots. The NaN padding lets the last slots average what is present.
+        padded = np.concatenate([values, np.full(half, np.nan)])
+        return bn.move_mean(padded, window, min_count=1)[half:]
+
+    valid = ~np.isnan(values)
+    kernel = np.ones(window)
+    # Convolving sums and counts separately, so the edges and NaN gaps average over what is present.
+    sums = np.convolve(np.where(valid, values, 0.0), kernel)[half:half + len(values)]
+    counts = np.convolve(valid.astype(np.float64), kernel)[half:half + len(values)]
+    with np.errstate(invalid="ignore"):
+        return sums / counts
+
+
+def _fill_gaps(values: np.ndarray) -> np.ndarray:
+    """
+    Linear interpolation over NaN gaps, holding the first/last valid value at the edges.
+    Same as .interpolate().bfill().ffill() on a default index, without the three Series rebuilds.
+    """
+    values = np.array(values, dtype=np.float64)
+    missing = np.isnan(values)
+    if missing.any() and not missing.all():
+        values[missing] = np.interp(np.flatnonzero(missing), np.flatnonzero(~missing), values[~missing])
+    return values
+
+
 def clean_forecast_data(df: pd.DataFrame) -> pd.DataFrame:
     """
     Small sanitization + features; keep timestamps tz-aware in Nairobi.
     """
-    df = df.sort_values("timestamp").copy()
+    df = df.sort_values("timestamp")  # Already a new frame. No extra .copy() needed.
 
     # Smoothing any tiny spikes in GTI. Uses a 3-point rolling mean. Nice for how the visuals look. Not too important.
-    df["Global Tilted Irradiation"] = (
-        df["Global Tilted Irradiation"]
-        .rolling(window=3, center=True, min_periods=1)
-        .mean()
-    )
+    df["Global Tilted Irradiation"] = _centered_mean(df["Global Tilted Irradiation"].to_numpy(dtype=np.float64))
 
     # Filling tiny gaps in temperature. Linear interpolating, then backfilling or frontfilling any edge NaNs.
-    df["air_temp"] = df["air_temp"].interpolate().bfill().ffill()
+    df["air_temp"] = _fill_gaps(df["air_temp"].to_numpy(dtype=np.float64))
 
-    # Adding time-based features
-    df["hour"] = df["timestamp"].dt.hour
-    df["dayofyear"] = df["timestamp"].dt.dayofyear
+    # Adding time-based features. Straight from the local wall-clock datetime64 values, no .dt accessor per feature.
+    ts = df["timestamp"]
+    if ts.dt.tz is not None:
+        ts = ts.dt.tz_localize(None)
+    local = ts.to_numpy(dtype="datetime64[ns]")
+    df["hour"] = local.astype("datetime64[h]").astype(np.int64) % 24
+    days = local.astype("datetime64[D]")
+    df["dayofyear"] = (days - days.astype("datetime64[Y]")).astype(np.int64) + 1
     return df
 
 
+@lru_cache(maxsize=1)
 def load_model_and_scaler():
-    model = joblib.load("models/xgb_model.pkl")
+    """
+    Load the model and scaler once per process; later calls reuse the same objects.
+    The model is the compiled tree library when one has been built, else the raw XGBoost Booster.
+    """
     scaler = joblib.load("models/xgb_scaler.pkl")
+    if tl2cgen is not None and os.path.exists(MODEL_LIB_PATH):
+        # One thread is fastest for our 24-row batches.
+        return tl2cgen.Predictor(MODEL_LIB_PATH, nthread=1), scaler
+
+    model = joblib.load("models/xgb_model.pkl").get_booster()
+    model.set_param({"nthread": os.cpu_count()})
     return model, scaler
 
 
+def _run_model(model, feats):
+    """Predict on a float32 feature array with whichever model load_model_and_scaler returned."""
+    if tl2cgen is not None and isinstance(model, tl2cgen.Predictor):
+        return model.predict(tl2cgen.DMatrix(feats)).reshape(-1)
+    # Predicting straight on the array. Skips the DMatrix the sklearn wrapper would build per call.
+    return model.inplace_predict(feats)
+
+
 def predict_next_day_production(lat, lon):
     """
     Return DataFrame with Nairobi-aware timestamps, the raw irradiance,
     and the predicted solar production (Wh per 30-min slot).
     """
-    forecast = fetch_openmeteo_forecast(lat, lon)
-    forecast = clean_forecast_data(forecast)
+    return predict_next_day_production_batch([(lat, lon)])[0]
+
+
+def predict_next_day_production_batch(coords):
+    """
+    Same as predict_next_day_production for a list of (lat, lon) pairs, one DataFrame per location.
+    All locations go through the model in a single predict call.
+    """
+    forecasts = [clean_forecast_data(forecast) for forecast in fetch_openmeteo_forecasts(coords)]
+    if not forecasts:
+        return []
 
     model, scaler = load_model_and_scaler()
 
-    feats = forecast[["Global Tilted Irradiation", "air_temp", "hour", "dayofyear"]]
-    feats_scaled = scaler.transform(feats)
+    # One row-major float32 matrix for every location, filled column by column straight from the
+    # forecast arrays. MinMaxScaler.transform is just x * scale_ + min_, so it is applied during the
+    # fill (in float64, then cast) and the model input stays bit-identical to scaler.transform.
+    offsets = np.cumsum([len(forecast) for forecast in forecasts])
+    feats_scaled = np.empty((offsets[-1], len(FEATURE_COLUMNS)), dtype=np.float32)
+    for forecast, end in zip(forecasts, offsets):
+        rows = slice(end - len(forecast), end)
+        for j, col in enumerate(FEATURE_COLUMNS):
+            feats_scaled[rows, j] = forecast[col].to_numpy(dtype=np.float64) * scaler.scale_[j] + scaler.min_[j]
+    predictions = _run_model(model, feats_scaled)
 
-    forecast["predicted_solar_production"] = model.predict(feats_scaled)
-    # Only returning key columns. Minor key step.
-    return forecast[["timestamp", "Global Tilted Irradiation", "predicted_solar_production"]]
+    # Splitting the stacked predictions back per location.
+    offsets = offsets[:-1]
+    results = []
+    for forecast, predicted in zip(forecasts, np.split(predictions, offsets)):
+        forecast["predicted_solar_production"] = predicted
+        # Only returning key columns. Minor key step.
+        results.append(forecast[["timestamp", "Global Tilted Irradiation", "predicted_solar_production"]])
+    return results
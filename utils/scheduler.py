@@ -15,12 +15,25 @@
 #   * Water Heater must finish by 09:00 (early morning).
 # If a constrained window can't be met, we fall back to the general daylight rule.
 
-import pandas as pd
 from __future__ import annotations # This allows using the class name in type hints within the class itself. Quite interesting.
+import pandas as pd
 import numpy as np
 
+try:
+    from numba import njit
+except ImportError:  # Numba is optional. Without it the placement kernel below just runs as plain Python.
+    def njit(*_args, **_kwargs):
+        return lambda fn: fn
+
 NBO_TZ = "Africa/Nairobi"
 
+# Slot length in minutes. The Open-Meteo forecast behind the PV prediction is hourly.
+SLOT_MINUTES = 60
+
+# Daylight window as minutes of the local day: 06:00 <= t < 18:00.
+DAYLIGHT_START_MIN = 6 * 60
+DAYLIGHT_END_MIN = 18 * 60
+
 # Rated power in kW and required contiguous duration in hours. Not slots!
 DEVICE_SPECS_HOURS = {
     "Laundry_Machine_kW": dict(power=3.0,  dur_hours=4.0),      # 4 hours
@@ -31,10 +44,32 @@ DEVICE_SPECS_HOURS = {
     "Ventilation_kW":      dict(power=1.5,  dur_hours=2.0),     # 2 hours
 }
 
+# Greedy Algorithm: largest power first to reduce conflicts. Built once as (device, power kW, duration hours).
+_DEVICE_ORDER = tuple(sorted(
+    ((dev, float(spec["power"]), float(spec["dur_hours"])) for dev, spec in DEVICE_SPECS_HOURS.items()),
+    key=lambda t: -t[1],
+))
+_DEVICE_POWERS = np.array([power for _dev, power, _dur_hours in _DEVICE_ORDER])
+
 # Lets define some helper functions first.
-def _to_nairobi(df: pd.DataFrame, ts_col: str = "timestamp") -> pd.DataFrame:
-    out = df.copy()
-    out[ts_col] = pd.to_datetime(out[ts_col], utc=True).dt.tz_convert(NBO_TZ)
+def _to_nairobi(ts: pd.Series) -> pd.Series:
+    """Timestamps as tz-aware Africa/Nairobi. Naive values are taken as UTC."""
+    if isinstance(ts.dtype, pd.DatetimeTZDtype):
+        return ts.dt.tz_convert(NBO_TZ)  # Already tz-aware (e.g. straight from the forecast). No UTC round-trip.
+    if pd.api.types.is_datetime64_dtype(ts.dtype):
+        return ts.dt.tz_localize("UTC").dt.tz_convert(NBO_TZ)
+    return pd.to_datetime(ts, utc=True, format="ISO8601", cache=True).dt.tz_convert(NBO_TZ)  # e.g. CSV strings
+
+def _tomorrow_rows(df: pd.DataFrame, day_00: pd.Timestamp, day_24: pd.Timestamp, columns=None) -> pd.DataFrame:
+    """Tomorrow's rows indexed by their Nairobi timestamp, sorted. The row filter is the only copy made."""
+    ts = _to_nairobi(df["timestamp"])
+    keep = ((ts >= day_00) & (ts < day_24)).to_numpy()
+    if columns is None:
+        columns = [c for c in df.columns if c != "timestamp"]
+    out = df.loc[keep, columns]
+    out.index = pd.DatetimeIndex(ts[keep], name="timestamp")
+    if not out.index.is_monotonic_increasing:
+        out = out.sort_index()
     return out
 
 def _tomorrow_bounds() -> tuple[pd.Timestamp, pd.Timestamp]:
@@ -42,12 +77,90 @@ def _tomorrow_bounds() -> tuple[pd.Timestamp, pd.Timestamp]:
     day_start = now_nbo.normalize() + pd.Timedelta(days=1)
     return day_start, day_start + pd.Timedelta(days=1)
 
-def _daylight_bounds() -> tuple[pd.Timestamp, pd.Timestamp]:
-    day_00, _day_24 = _tomorrow_bounds()
-    return day_00 + pd.Timedelta(hours=6), day_00 + pd.Timedelta(hours=18)
+@njit(cache=True)
+def _prefix_sums(values):
+    """csum[k] is the sum of values[:k], NaNs counted as 0. Any block sum is then csum[i + L] - csum[i]."""
+    csum = np.zeros(values.shape[0] + 1)
+    for k in range(values.shape[0]):
+        v = values[k]
+        csum[k + 1] = csum[k] + (v if v == v else 0.0)
+    return csum
+
+@njit(cache=True)
+def _best_window(scores_csum, remaining, daylight_ok, power, dur_slots, lo, hi, use_headroom):
+    """
+    Best start for one pass of the greedy search, or -1 if nothing fits.
+    Windows must sit inside slots [lo, hi) and in daylight. With `use_headroom` every slot
+    must also fit the device. The score is the block sum read off `scores_csum`.
+    """
+    n = remaining.shape[0]
+    best_i, best_score = -1, -1e18
+
+    # Running count of slots short on headroom: add the slot coming in, drop the one going out.
+    short = 0
+    for k in range(dur_slots - 1):
+        if remaining[k] - power < -1e-12:
+            short += 1
+
+    for i in range(0, n - dur_slots + 1):
+        if remaining[i + dur_slots - 1] - power < -1e-12:
+            short += 1
+        if i > 0 and remaining[i - 1] - power < -1e-12:
+            short -= 1
+
+        if i < lo or i + dur_slots > hi or not daylight_ok[i]:
+            continue
+        if use_headroom and short > 0:
+            continue
+        score = scores_csum[i + dur_slots] - scores_csum[i]
+        if score > best_score:
+            best_score, best_i = score, i
+    return best_i
+
+@njit(cache=True)
+def _place_devices(remaining, solar, daylight_ok, powers, constraints):
+    """
+    Greedy placement of every device, in the given order.
+    `constraints` rows are (dur_slots, earliest_start, latest_end, has_window) in slot indices,
+    `daylight_ok[d, i]` says whether device d's block starting at slot i is all in daylight.
+    Consumes `remaining` in place and returns the start slot per device (-1 if none fits).
+    """
+    n = remaining.shape[0]
+    best = np.full(powers.shape[0], -1, dtype=np.int64)
+    # PV never changes, headroom only after a placement, so both prefix sums are rarely rebuilt.
+    solar_csum = _prefix_sums(solar)
+    remaining_csum = _prefix_sums(remaining)
+    for d in range(powers.shape[0]):
+        power = powers[d]
+        dur_slots, lo, hi, has_window = constraints[d, 0], constraints[d, 1], constraints[d, 2], constraints[d, 3]
+        if dur_slots <= 0 or n < dur_slots:
+            continue
 
-def _window_sum(series: pd.Series, start: int, length: int) -> float:
-    return float(series.iloc[start:start + length].sum())
+        #  Pass A: daylight + headroom. Try to fit device kW in every slot first.
+        best_i = _best_window(remaining_csum, remaining, daylight_ok[d], power, dur_slots, lo, hi, True)
+
+        # Pass B: relaxed device window. Ignore headroom, just daylight + device window.
+        if best_i < 0:
+            best_i = _best_window(solar_csum, remaining, daylight_ok[d], power, dur_slots, lo, hi, False)
+
+        # Final fallback: general daylight ignoring special window. Only for devices that have one.
+        if best_i < 0 and has_window:
+            # Try daylight + headroom, if still none, daylight-only
+            best_i = _best_window(remaining_csum, remaining, daylight_ok[d], power, dur_slots, 0, n, True)
+            if best_i < 0:
+                best_i = _best_window(solar_csum, remaining, daylight_ok[d], power, dur_slots, 0, n, False)
+
+        if best_i < 0:
+            # No valid window found — skip this device
+            continue
+        best[d] = best_i
+
+        # Consume headroom for subsequent devices. Never below 0. In place, no temporaries.
+        block = remaining[best_i:best_i + dur_slots]
+        np.subtract(block, power, block)
+        np.maximum(block, 0.0, block)
+        remaining_csum = _prefix_sums(remaining)
+    return best
 
 def _infer_slot_minutes(index: pd.DatetimeIndex) -> int:
     """Infer the median step in minutes from the index; fallback to 30 if unknown."""
@@ -61,17 +174,12 @@ def _infer_slot_minutes(index: pd.DatetimeIndex) -> int:
 # The scheduler function starts from here:
 def schedule_loads(load_df: pd.DataFrame, solar_df: pd.DataFrame) -> pd.DataFrame:
     # Normalizing & keep only tomorrow:
-    df = _to_nairobi(load_df, "timestamp")
-    pv = _to_nairobi(solar_df, "timestamp")
-
     day_00, day_24 = _tomorrow_bounds()
-    df = df[(df["timestamp"] >= day_00) & (df["timestamp"] < day_24)].copy()
-    pv = pv[(pv["timestamp"] >= day_00) & (pv["timestamp"] < day_24)].copy()
+    df = _tomorrow_rows(load_df, day_00, day_24)
+    pv = _tomorrow_rows(solar_df, day_00, day_24, columns=["predicted_solar_production"])
 
     # Aligning on the timestamp:
-    df = df.sort_values("timestamp").set_index("timestamp")
-    pv = pv.sort_values("timestamp").set_index("timestamp")
-    aligned = df.join(pv[["predicted_solar_production"]], how="inner")
+    aligned = df.join(pv, how="inner")
 
     # Core columns:
     if "base_load_kW" not in aligned.columns:
@@ -79,121 +187,87 @@ def schedule_loads(load_df: pd.DataFrame, solar_df: pd.DataFrame) -> pd.DataFram
     if "total_load_kW" not in aligned.columns:
         aligned["total_load_kW"] = aligned["base_load_kW"].astype(float)
 
-    # Clearing any existing device values for tomorrow. Key as it avoids splits and carryovers.
-    for dev in DEVICE_SPECS_HOURS.keys():
-        aligned[dev] = 0.0
     # If Food_Warmers_kW existed historically, clear that too :)
     if "Food_Warmers_kW" in aligned.columns:
         aligned["Food_Warmers_kW"] = 0.0
 
     n = len(aligned)
+    # Clearing any existing device values for tomorrow. Key as it avoids splits and carryovers.
+    # The scheduling core works on plain arrays (one column per device, in DEVICE_SPECS_HOURS order)
+    # and the frame gets them back in one go at the end.
+    device_col = {dev: k for k, dev in enumerate(DEVICE_SPECS_HOURS)}
+    device_kw = np.zeros((n, len(device_col)), dtype=float)
     if n == 0:
-        return aligned.reset_index()
+        return aligned.assign(**{dev: device_kw[:, k] for dev, k in device_col.items()}).reset_index()
 
-    # Infering slot duration:
-    slot_minutes = _infer_slot_minutes(aligned.index)
+    # Slot duration. Only inferred when the index is not an unbroken run of SLOT_MINUTES steps:
+    slot_minutes = SLOT_MINUTES
+    if n < 2 or aligned.index[-1] - aligned.index[0] != pd.Timedelta(minutes=SLOT_MINUTES * (n - 1)):
+        slot_minutes = _infer_slot_minutes(aligned.index)
     slot_hours = slot_minutes / 60.0
 
     # Scheduling each device:
     # Converting PV Wh/slot to instantaneous kW per slot duration
-    aligned["solar_kW"] = aligned["predicted_solar_production"] / (slot_hours * 1000.0)
+    solar = aligned["predicted_solar_production"].to_numpy(dtype=float) / (slot_hours * 1000.0)
 
-    # Daylight bounds. Key. Please note that these are tz-aware timestamps in Nairobi. Don't mess this up
-    six_am, six_pm = _daylight_bounds()
+    # Device window bounds. Key. Please note that these are tz-aware timestamps in Nairobi. Don't mess this up
     noon       = day_00 + pd.Timedelta(hours=12)
     elev_start = day_00 + pd.Timedelta(hours=11)  # dishwasher earliest start
     elev_end   = day_00 + pd.Timedelta(hours=14)  # dishwasher latest finish
     morning_9  = day_00 + pd.Timedelta(hours=9)   # heater latest finish
 
-    allowed_mask = (aligned.index >= six_am) & (aligned.index < six_pm)
-    allowed_bool = np.asarray(allowed_mask, dtype=bool)
+    # Daylight mask from integer minute-of-day on the Nairobi wall clock. Every slot is already tomorrow.
+    minute_of_day = aligned.index.tz_localize(None).to_numpy(dtype="datetime64[m]").astype(np.int64) % 1440
+    allowed_bool = (minute_of_day >= DAYLIGHT_START_MIN) & (minute_of_day < DAYLIGHT_END_MIN)
 
     # PV headroom after base load
-    aligned["remaining_kW"] = (aligned["solar_kW"] - aligned["base_load_kW"]).clip(lower=0.0)
-    remaining = aligned["remaining_kW"].copy()
-
-    # Greedy Algorithm: largest power first to reduce conflicts:
-    devices_sorted = sorted(DEVICE_SPECS_HOURS.keys(), key=lambda d: -DEVICE_SPECS_HOURS[d]["power"])
-
-    def _slot_ok_with_window(dev: str, i: int, dur_slots: int) -> bool:
-        """Check daylight + device-specific time window."""
-        if not allowed_bool[i:i + dur_slots].all():
-            return False
-
-        ts_start = aligned.index[i]
-        ts_end   = aligned.index[i + dur_slots - 1] + pd.Timedelta(minutes=slot_minutes)
-
-        if dev == "Oven_kW":
-            return ts_end <= noon
-        elif dev == "Dishwasher_kW":
-            return (ts_start >= elev_start) and (ts_end <= elev_end)
-        elif dev == "Water_Heater_kW":
-            return ts_end <= morning_9
-        else:
-            return True  # daylight only
-
-    for dev in devices_sorted:
-        power = float(DEVICE_SPECS_HOURS[dev]["power"])
-        dur_hours = float(DEVICE_SPECS_HOURS[dev]["dur_hours"])
-        dur_slots = max(int(round(dur_hours * 60.0 / slot_minutes)), 1)
-
-        if dur_slots <= 0 or n < dur_slots:
+    remaining = solar - aligned["base_load_kW"].to_numpy(dtype=float)
+    np.maximum(remaining, 0.0, out=remaining)
+
+    # Device-specific windows as (earliest start, latest finish). Anything else is daylight only.
+    device_windows = {
+        "Oven_kW":         (None, noon),
+        "Dishwasher_kW":   (elev_start, elev_end),
+        "Water_Heater_kW": (None, morning_9),
+    }
+    slot_ends = aligned.index + pd.Timedelta(minutes=slot_minutes)
+
+    # Translating every constraint to slot indices once, so the kernel never touches a Timestamp.
+    constraints = np.empty((len(_DEVICE_ORDER), 4), dtype=np.int64)
+    for d, (dev, _power, dur_hours) in enumerate(_DEVICE_ORDER):
+        earliest, latest = device_windows.get(dev, (None, None))
+        constraints[d] = (
+            max(int(round(dur_hours * 60.0 / slot_minutes)), 1),
+            0 if earliest is None else aligned.index.searchsorted(earliest, side="left"),
+            n if latest is None else slot_ends.searchsorted(latest, side="right"),
+            dev in device_windows,
+        )
+
+    # Daylight check per candidate start, once per distinct duration: a block is in daylight when
+    # it covers as many daylight slots as it is long.
+    daylight_counts = np.concatenate(([0], np.cumsum(allowed_bool, dtype=np.int64)))
+    daylight_ok = np.zeros((len(_DEVICE_ORDER), n), dtype=bool)
+    by_duration = {}
+    for d, dur_slots in enumerate(constraints[:, 0]):
+        if dur_slots > n:
             continue
+        if dur_slots not in by_duration:
+            by_duration[dur_slots] = daylight_counts[dur_slots:] - daylight_counts[:-dur_slots] == dur_slots
+        daylight_ok[d, :n - dur_slots + 1] = by_duration[dur_slots]
 
-        best_i, best_score = None, -1e18
-
-        #  Pass A: daylight + headroom. Try to fit device kW in every slot first.
-        for i in range(0, n - dur_slots + 1):
-            if not _slot_ok_with_window(dev, i, dur_slots):
-                continue
-            if (remaining.iloc[i:i + dur_slots] - power < -1e-12).any():
-                continue
-            score = _window_sum(remaining, i, dur_slots)
-            if score > best_score:
-                best_score, best_i = score, i
+    best_starts = _place_devices(remaining, solar, daylight_ok, _DEVICE_POWERS, constraints)
 
-        # Pass B: relaxed device window. Ignore headroom, just daylight + device window.
-        if best_i is None:
-            for i in range(0, n - dur_slots + 1):
-                if not _slot_ok_with_window(dev, i, dur_slots):
-                    continue
-                score = _window_sum(aligned["solar_kW"], i, dur_slots)
-                if score > best_score:
-                    best_score, best_i = score, i
-
-        # Final fallback: general daylight ignoring special window. Only for Oven, Dishwasher, Water Heater.
-        if best_i is None and dev in {"Oven_kW", "Dishwasher_kW", "Water_Heater_kW"}:
-            # Try daylight + headroom
-            for i in range(0, n - dur_slots + 1):
-                if not allowed_bool[i:i + dur_slots].all():
-                    continue
-                if (remaining.iloc[i:i + dur_slots] - power < -1e-12).any():
-                    continue
-                score = _window_sum(remaining, i, dur_slots)
-                if score > best_score:
-                    best_score, best_i = score, i
-            # If still none, daylight-only
-            if best_i is None:
-                for i in range(0, n - dur_slots + 1):
-                    if not allowed_bool[i:i + dur_slots].all():
-                        continue
-                    score = _window_sum(aligned["solar_kW"], i, dur_slots)
-                    if score > best_score:
-                        best_score, best_i = score, i
-
-        if best_i is None:
-            # No valid window found — skip this device
+    total_load = aligned["total_load_kW"].to_numpy(dtype=float, copy=True)
+    for d, (dev, power, _dur_hours) in enumerate(_DEVICE_ORDER):
+        best_i, dur_slots = int(best_starts[d]), int(constraints[d, 0])
+        if best_i < 0:
             continue
-
         # Placing a single contiguous block. This is important because the algorithm would assume devices can split and thats not practical
-        idx_slice = aligned.index[best_i:best_i + dur_slots]
-        aligned.loc[idx_slice, dev] = power
-        aligned.loc[idx_slice, "total_load_kW"] += power
-
-        # Consume headroom for subsequent devices. Never below 0.
-        remaining.iloc[best_i:best_i + dur_slots] = (
-            remaining.iloc[best_i:best_i + dur_slots] - power
-        ).clip(lower=0.0)
+        device_kw[best_i:best_i + dur_slots, device_col[dev]] = power
+        total_load[best_i:best_i + dur_slots] += power
 
     # Returning a nice clean frame :)
-    return aligned.drop(columns=["solar_kW", "remaining_kW"], errors="ignore").reset_index()
+    return aligned.assign(
+        total_load_kW=total_load,
+        **{dev: device_kw[:, k] for dev, k in device_col.items()},
+    ).reset_index()